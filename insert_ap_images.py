@@ -11,7 +11,7 @@ For each AP on that floor:
   - Creates ONE NEW NOTE PER IMAGE (Rule A).
   - Each new note has exactly one imageId.
   - Adds the new note's ID to the AP's noteIds list.
-  - Writes image data into files named: image-<uuid>
+  - Writes image data into project members named: image-<uuid>
   - Adds metadata for each image into images.json
 
 Existing notes for the AP are left untouched.
@@ -21,41 +21,377 @@ Usage:
 
 You may pass the same path for SRC_ESX and DEST_ESX to overwrite
 the original project file (keep a backup if you care).
+
+The project is never extracted to disk: untouched members are streamed
+from SRC_ESX straight into DEST_ESX, and only the modified JSON files and
+the new image-<uuid> members are written fresh.
 """
 
 import argparse
+import contextlib
+import copy
 import time
 import zipfile
 import json
-import shutil
-import pathlib
+import logging
 import os
-import uuid
 import re
+import shutil
+import sys
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("insert_ap")
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; stdlib json is the fallback
+    orjson = None
+
+# Buffer / chunk size for reading and writing the project archives
+COPY_BUFSIZE = 1024 * 1024
+
+# Deflate level for the JSON members written into the output project;
+# favour speed over ratio.
+COMPRESS_LEVEL = 1
+
+# Supported image file extensions -> images.json imageFormat
+IMAGE_FORMATS = {"png": "PNG", "jpg": "JPG", "jpeg": "JPEG"}
+
+# Number of image files read ahead (concurrently) while the project is written
+IMAGE_READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Images larger than this are streamed into the project rather than read ahead
+PREFETCH_MAX_SIZE = 8 * 1024 * 1024
+
+# Cap on image bytes read ahead but not yet written. At most this much
+# (plus the one image being written, itself at most PREFETCH_MAX_SIZE)
+# is held in memory at once.
+PREFETCH_MAX_BYTES = 32 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_project(esx_path):
+    """
+    Open an .esx for reading through a COPY_BUFSIZE-buffered file, so the
+    archive is read in large chunks rather than io's default 8 KiB.
+    """
+    with open(esx_path, "rb", buffering=COPY_BUFSIZE) as fp, \
+            zipfile.ZipFile(fp, "r") as zf:
+        yield zf
+
+
+# orjson reads integers beyond 64 bits as floats. Every such integer has at
+# least 19 digits, so data containing a run of 19+ digits is left to json.
+_LONG_DIGITS = re.compile(rb"\d{19}")
+
+
+class _NonFiniteFloat(float):
+    """
+    NaN/Infinity read by json. orjson would write these as null but refuses
+    float subclasses, so dump_json hands documents holding one to json,
+    which writes them back as read.
+    """
+
+
+def load_json(zf, name):
+    """
+    Parse the JSON member `name` of an open project ZipFile.
+
+    orjson is used when installed, except for data it would not read the
+    way json does: integers beyond 64 bits and NaN/Infinity.
+    """
+    data = zf.read(name)
+    if orjson is not None and not _LONG_DIGITS.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. NaN/Infinity; json accepts those or reports the error
+    return json.loads(data, parse_constant=_NonFiniteFloat)
+
+
+def dump_json(data, pretty=False):
+    """
+    Serialize `data` to UTF-8 JSON bytes, ready to be written into the project.
+
+    Ekahau reads compact JSON fine; pretty=True indents by 2 for debugging.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except orjson.JSONEncodeError:
+            pass  # integers beyond 64 bits or NaN/Infinity; json writes them as read
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def copy_stream(src, dst, buf):
+    """
+    Copy src to dst through `buf` (a memoryview over a bytearray), which is
+    reused for every chunk and every file instead of allocating a new one.
+    """
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        dst.write(buf[:n])
+
+
+def copy_member(zin, zout, info, buf):
+    """
+    Copy one member from the source project into the destination project.
+
+    Stored and deflated members (what Ekahau writes) keep their compressed
+    bytes as-is; any other compression method is decompressed and
+    recompressed with the same method through ZipFile.
+    """
+    if info.flag_bits & 0x1:
+        raise RuntimeError(f"{info.filename!r} is encrypted; encrypted projects are not supported")
+    if info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        copy_member_raw(zin, zout, info, buf)
+    else:
+        stream_member(zin, zout, info, buf)
+
+
+def copy_member_raw(zin, zout, info, buf):
+    """
+    Copy a stored or deflated member without an inflate/deflate round-trip.
+
+    The member is still validated while it is copied: the local header must
+    match the central directory, and the CRC-32 and size of the data must
+    match, so a corrupt source raises BadZipFile as extraction would.
+    """
+    # Source local header: 30 fixed bytes, then file name and extra field
+    src = zin.fp
+    src.seek(info.header_offset)
+    header = src.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename!r}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    fname = src.read(name_len).decode("utf-8" if info.flag_bits & 0x800 else "cp437")
+    if fname != info.orig_filename:
+        raise zipfile.BadZipFile(
+            f"File name in directory {info.orig_filename!r} and header {fname!r} differ."
+        )
+    src.seek(extra_len, os.SEEK_CUR)
+
+    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+    out_info.compress_type = info.compress_type
+    # Sizes and CRC go in the local header, so no trailing data descriptor
+    out_info.flag_bits = info.flag_bits & ~0x08
+    out_info.external_attr = info.external_attr
+    out_info.comment = info.comment
+    out_info.create_system = info.create_system
+    out_info.CRC = info.CRC
+    out_info.compress_size = info.compress_size
+    out_info.file_size = info.file_size
+
+    def write_data(dst):
+        # Inflate only to check the CRC; the compressed bytes are what get written
+        inflate = zlib.decompressobj(-15) if info.compress_type == zipfile.ZIP_DEFLATED else None
+        crc = 0
+        size = 0
+        remaining = info.compress_size
+        while remaining:
+            n = src.readinto(buf[:min(remaining, len(buf))])
+            if not n:
+                raise zipfile.BadZipFile(f"Truncated member {info.filename!r}")
+            chunk = buf[:n]
+            dst.write(chunk)
+            remaining -= n
+            if inflate is None:
+                crc = zlib.crc32(chunk, crc)
+                size += n
+                continue
+            data = inflate.decompress(chunk, COPY_BUFSIZE)
+            while True:
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                if not inflate.unconsumed_tail:
+                    break
+                data = inflate.decompress(inflate.unconsumed_tail, COPY_BUFSIZE)
+        if inflate is not None:
+            data = inflate.flush()
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+        if crc != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+        if size != info.file_size:
+            raise zipfile.BadZipFile(f"Bad size for file {info.filename!r}")
+
+    append_raw_member(zout, out_info, write_data)
+
+
+def stream_member(zin, zout, info, buf):
+    """
+    Copy a member by decompressing it from zin and recompressing it into
+    zout with the same compression method.
+    """
+    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+    out_info.compress_type = info.compress_type
+    out_info.external_attr = info.external_attr
+    out_info.comment = info.comment
+    out_info.create_system = info.create_system
+    out_info.file_size = info.file_size
+    with zin.open(info) as src, zout.open(out_info, "w") as dst:
+        copy_stream(src, dst, buf)
+
 
+# ZipFile attributes append_raw_member relies on
+_RAW_MEMBER_ZIPFILE_ATTRS = ("fp", "start_dir", "filelist", "NameToInfo", "_didModify", "_writing")
 
-def load_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
 
+def append_raw_member(zout, info, write_data):
+    """
+    Append a member to zout whose already-compressed data is written by
+    write_data(fp); info must carry the final CRC and sizes.
+
+    ZipFile has no public API for adding pre-compressed data, so this does
+    by hand what ZipFile.open(info, "w") and its writer's close() do:
+      - fp / start_dir: the local header and data go where the central
+        directory would otherwise start, and start_dir moves past them
+      - filelist / NameToInfo: register the entry so close() writes its
+        central directory record
+      - _didModify: make close() write the central directory at all
+    This is the only place that touches ZipFile internals. The guard below
+    only checks that these attributes exist; it cannot tell whether a future
+    zipfile gives them a different meaning.
+    """
+    if not all(hasattr(zout, a) for a in _RAW_MEMBER_ZIPFILE_ATTRS):
+        raise RuntimeError("zipfile internals differ from what append_raw_member expects")
+    if zout._writing:
+        raise ValueError("Can't append a member while another one is open for writing")
 
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    fp = zout.fp
+    fp.seek(zout.start_dir)
+    info.header_offset = fp.tell()
+    fp.write(info.FileHeader())
+    write_data(fp)
 
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout.start_dir = fp.tell()
+    zout._didModify = True
 
-def extract_project(esx_file, extract_dir):
-    with zipfile.ZipFile(esx_file, "r") as zf:
-        zf.extractall(extract_dir)
 
+def read_file(path):
+    # Unbuffered FileIO: readall() sizes its read from fstat and skips
+    # the BufferedReader layer, which buys nothing for whole-file reads.
+    with open(path, "rb", buffering=0) as f:
+        return f.readall()
 
-def repack_project(extract_dir, output_esx):
-    with zipfile.ZipFile(output_esx, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(extract_dir):
-            for name in files:
-                full_path = os.path.join(root, name)
-                rel_path = os.path.relpath(full_path, extract_dir)
-                zf.write(full_path, rel_path)
+
+def read_images_ahead(new_images):
+    """
+    Yield (arcname, image_path, stat, data) for each new image, in order.
+
+    Image files up to PREFETCH_MAX_SIZE are read on a thread pool, ahead of
+    the consumer, so disk reads overlap with writing the previous images.
+    The read-ahead window is bounded both by IMAGE_READ_WORKERS files and by
+    PREFETCH_MAX_BYTES. Larger files are yielded with data=None and streamed
+    from disk by add_image_member instead of being held in memory.
+    """
+    def take(entry):
+        arcname, img_path, st, _, future = entry
+        return arcname, img_path, st, (future.result() if future is not None else None)
+
+    with ThreadPoolExecutor(max_workers=IMAGE_READ_WORKERS) as pool:
+        pending = deque()
+        pending_bytes = 0
+        for arcname, img_path, st in new_images:
+            size = st.st_size if st.st_size <= PREFETCH_MAX_SIZE else 0
+            # Drain until this image fits in the read-ahead window
+            while pending and (len(pending) >= IMAGE_READ_WORKERS
+                               or pending_bytes + size > PREFETCH_MAX_BYTES):
+                entry = pending.popleft()
+                pending_bytes -= entry[3]
+                yield take(entry)
+
+            future = None
+            if st.st_size <= PREFETCH_MAX_SIZE:
+                future = pool.submit(read_file, img_path)
+            pending.append((arcname, img_path, st, size, future))
+            pending_bytes += size
+        while pending:
+            yield take(pending.popleft())
+
+
+def add_image_member(zout, arcname, img_path, st, data, buf):
+    """
+    Write an image into the project as `arcname` (stored, not deflated):
+    from `data` if it was read ahead, otherwise streamed from img_path
+    through `buf`.
+
+    `st` is the image's stat result from collect_images; the ZipInfo is
+    built from it the way ZipInfo.from_file would, without another stat().
+    """
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:  # earliest timestamp a zip entry can hold
+        date_time = (1980, 1, 1, 0, 0, 0)
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    info.file_size = st.st_size
+    info.compress_type = zipfile.ZIP_STORED
+    if data is not None:
+        zout.writestr(info, data)
+        return
+    # info.file_size is already set, so ZipFile picks ZIP64 itself if needed
+    with open(img_path, "rb", buffering=0) as src, zout.open(info, "w") as dst:
+        copy_stream(src, dst, buf)
+
+
+def rewrite_project(esx_src_path, output_esx, json_members, new_images, pretty_json=False):
+    """
+    Write output_esx as a copy of esx_src_path where:
+      - members named in json_members ({name: data}) are replaced by the
+        re-serialized data (or added if the source did not have them)
+      - new_images ([(arcname, image_path, stat)]) are added from disk
+
+    pretty_json is passed on to dump_json() for the re-serialized members.
+
+    The output is written to a fresh temporary file next to output_esx and
+    moved into place at the end, so SRC and DEST may be the same file. If
+    output_esx is a symlink, the file it points to is replaced.
+    """
+    output_esx = os.path.realpath(output_esx)
+    fd, tmp_esx = tempfile.mkstemp(
+        prefix=".insert_ap_images-", suffix=".esx.tmp", dir=os.path.dirname(output_esx)
+    )
+    dst_fp = os.fdopen(fd, "wb", buffering=COPY_BUFSIZE)
+    try:
+        with dst_fp:
+            # mkstemp creates the file 0600: give it DEST's mode, or the usual default
+            if os.path.exists(output_esx):
+                shutil.copymode(output_esx, tmp_esx)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_esx, 0o666 & ~umask)
+
+            with open_project(esx_src_path) as zin, \
+                    zipfile.ZipFile(dst_fp, "w", zipfile.ZIP_DEFLATED,
+                                    compresslevel=COMPRESS_LEVEL) as zout:
+                buf = memoryview(bytearray(COPY_BUFSIZE))  # shared by every streamed copy
+                pending = dict(json_members)
+                for info in zin.infolist():
+                    if info.filename in pending:
+                        zout.writestr(info.filename, dump_json(pending.pop(info.filename), pretty_json))
+                    else:
+                        copy_member(zin, zout, info, buf)
+
+                for name, data in pending.items():
+                    zout.writestr(name, dump_json(data, pretty_json))
+
+                for arcname, img_path, st, data in read_images_ahead(new_images):
+                    add_image_member(zout, arcname, img_path, st, data, buf)
+    except BaseException:
+        os.remove(tmp_esx)
+        raise
+    os.replace(tmp_esx, output_esx)
 
 
 def parse_ap_name_from_filename(filename):
@@ -64,13 +400,26 @@ def parse_ap_name_from_filename(filename):
     AP01-1.png           -> AP01
     AP with spaces-2.png -> AP with spaces
     """
-    base, _ = os.path.splitext(filename)
-    m = re.match(r"^(.*?)(?:-\d+)?$", base)
-    if m:
-        return m.group(1)
+    base = filename.rpartition(".")[0] or filename
+    # Strip an optional trailing "-<n>" image counter
+    head, sep, tail = base.rpartition("-")
+    if sep and tail.isdecimal():
+        return head
     return base
 
 
+def image_format_for(filename):
+    """
+    AP01.png  -> PNG
+    AP01.JPEG -> JPEG
+    notes.txt -> None (not a supported image)
+    """
+    stem, _, ext = filename.rpartition(".")
+    if not stem:  # no extension, or a dotfile such as ".png"
+        return None
+    return IMAGE_FORMATS.get(ext.lower())
+
+
 def build_floor_name_to_id(floorPlans):
     mapping = {}
     for f in floorPlans.get("floorPlans", []):
@@ -80,9 +429,20 @@ def build_floor_name_to_id(floorPlans):
     return mapping
 
 
+def normalize_ap_name(name):
+    """
+    Key used to match AP names from image filenames against accessPoints.json:
+    surrounding whitespace and case are ignored.
+    """
+    return name.strip().casefold()
+
+
 def build_ap_index(accessPoints):
     """
-    (floorPlanId, apName) -> AP dict
+    floorPlanId -> { normalize_ap_name(apName) -> [AP dicts] }
+
+    More than one AP per key means the floor has APs whose names differ
+    only in case/whitespace; see match_ap().
     """
     index = {}
     for ap in accessPoints.get("accessPoints", []):
@@ -90,29 +450,34 @@ def build_ap_index(accessPoints):
         loc = ap.get("location", {})
         floor_id = loc.get("floorPlanId")
         if name and floor_id:
-            index[(floor_id, name)] = ap
+            index.setdefault(floor_id, {}).setdefault(normalize_ap_name(name), []).append(ap)
     return index
 
 
-def build_note_index(notes):
+def match_ap(candidates, ap_name):
     """
-    noteId -> note dict
+    Pick the AP an image filename's ap_name refers to from the build_ap_index
+    candidates for its normalized name. When several APs share the
+    normalized name, only an exact name match is accepted; otherwise the
+    match is ambiguous and None is returned.
     """
-    idx = {}
-    for n in notes.get("notes", []):
-        nid = n.get("id")
-        if nid:
-            idx[nid] = n
-    return idx
+    if len(candidates) == 1:
+        return candidates[0]
+    exact = [ap for ap in candidates if ap.get("name") == ap_name]
+    return exact[0] if len(exact) == 1 else None
 
 
 def collect_images(images_root, floor_name_to_id):
     """
     Return:
-       mapping: { (floorPlanId, apName): [list of full image paths (sorted)] }
+       mapping: { floorPlanId: { normalize_ap_name(apName): [list of (full image path, imageFormat, stat, apName) (sorted)] } }
        skipped_images: [list of full image paths that cannot be matched to any floor]
 
-    Only floors that match floorPlans.json names are used.
+    Filenames that differ only in case/whitespace share one entry; each
+    image keeps the apName spelling from its own filename. Only floors that
+    match floorPlans.json names are used. Floors and AP names come out in
+    sorted order, so new notes are created in the same
+    order whatever order the filesystem lists directories in.
     """
     mapping = {}
     skipped_images = []
@@ -120,43 +485,54 @@ def collect_images(images_root, floor_name_to_id):
     if not os.path.isdir(images_root):
         raise FileNotFoundError(f"Images directory not found: {images_root}")
 
-    for floor_name in os.listdir(images_root):
-        floor_path = os.path.join(images_root, floor_name)
-        if not os.path.isdir(floor_path):
-            continue
+    # os.scandir() entries carry the file type from the directory read,
+    # so no extra stat() is needed per entry.
+    with os.scandir(images_root) as floors:
+        floor_entries = sorted((e for e in floors if e.is_dir()), key=lambda e: e.name)
+
+    for floor_entry in floor_entries:
+        floor_name = floor_entry.name
+        with os.scandir(floor_entry.path) as files:
+            file_entries = [e for e in files if e.is_file()]
 
         floor_id = floor_name_to_id.get(floor_name)
         if not floor_id:
             print(f"WARNING: Floor '{floor_name}' not found in floorPlans.json, skipping its images.")
             # Record image files in unknown floors as "not inserted"
-            for fname in sorted(os.listdir(floor_path)):
-                full = os.path.join(floor_path, fname)
-                if not os.path.isfile(full):
-                    continue
-                ext = os.path.splitext(fname)[1].lower()
-                if ext in [".png", ".jpg", ".jpeg"]:
-                    skipped_images.append(full)
+            for entry in file_entries:
+                if image_format_for(entry.name) is not None:
+                    skipped_images.append(entry.path)
             continue
 
-        for fname in sorted(os.listdir(floor_path)):
-            full = os.path.join(floor_path, fname)
-            if not os.path.isfile(full):
-                continue
-
-            ext = os.path.splitext(fname)[1].lower()
-            if ext not in [".png", ".jpg", ".jpeg"]:
+        floor_images = mapping.get(floor_id, {})
+        for entry in file_entries:
+            fname = entry.name
+            image_format = image_format_for(fname)
+            if image_format is None:
                 continue
 
             ap_name = parse_ap_name_from_filename(fname)
-            key = (floor_id, ap_name)
-            mapping.setdefault(key, []).append(full)
+            # DirEntry.stat() is kept so the image is not stat()ed again when zipped
+            floor_images.setdefault(normalize_ap_name(ap_name), []).append(
+                (entry.path, image_format, entry.stat(), ap_name)
+            )
+
+        if floor_images:  # only floors with at least one image
+            mapping[floor_id] = floor_images
+
+    # Sort only the kept images, per AP (all of an AP's images share a folder),
+    # and the AP names, rather than whole directory listings
+    for floor_id, floor_images in mapping.items():
+        for image_files in floor_images.values():
+            image_files.sort(key=lambda image: image[0])
+        mapping[floor_id] = dict(sorted(floor_images.items()))
 
     return mapping, skipped_images  # NEW: return skipped_images as well
 
 
 # --- images.json helpers -----------------------------------------------------
 
-def init_images_data(images_path):
+def init_images_data(zf):
     """
     Ensure we have a dict with an "images" list in it.
     Handles:
@@ -164,8 +540,8 @@ def init_images_data(images_path):
       - existing images.json that is just a list
       - missing file (start fresh)
     """
-    if os.path.isfile(images_path):
-        data = load_json(images_path)
+    if "images.json" in zf.NameToInfo:
+        data = load_json(zf, "images.json")
         if "images" not in data:
             if isinstance(data, list):
                 data = {"images": data}
@@ -176,28 +552,29 @@ def init_images_data(images_path):
     return data
 
 
-def add_image_metadata(images_data, img_id, img_path):
+def make_image_template(images_data):
+    """
+    Build the template for new images.json entries, once per run:
+      - a deep copy of the first existing entry if present
+      - otherwise an empty dict (minimal entry)
+    """
+    images_list = images_data.get("images")
+    if images_list:
+        return copy.deepcopy(images_list[0])
+    return {}
+
+
+def add_image_metadata(images_data, img_id, image_format, template):
     """
     Add a new image entry to images.json structure.
 
     We:
-      - Clone the first existing entry as template if present.
-      - Otherwise, create a minimal entry.
-      - Set id, imageFormat, status.
+      - Shallow-copy the template from make_image_template().
+      - Set id, imageFormat (as resolved by collect_images), status.
     """
-    ext = os.path.splitext(img_path)[1].lower()
-    if ext.startswith("."):
-        ext = ext[1:]
-    image_format = ext.upper() if ext else "PNG"
-
     images_list = images_data.setdefault("images", [])
 
-    if images_list:
-        template = images_list[0]
-        entry = json.loads(json.dumps(template))
-    else:
-        entry = {}
-
+    entry = template.copy()
     entry["id"] = img_id
     entry["imageFormat"] = image_format
     # leave resolutionWidth/Height from template if present, otherwise omit
@@ -206,18 +583,49 @@ def add_image_metadata(images_data, img_id, img_path):
     images_list.append(entry)
 
 
-def set_note_audit_fields(note, author_name="Brett Melnychuk"):
+def generate_uuid4s(count):
     """
-    Sets both the legacy numeric timestamps and the newer history.* fields
-    so Ekahau shows the correct creator + time in the UI.
+    Yield `count` random (version 4) UUID strings, drawing the randomness
+    for all of them from a single os.urandom() call.
+    """
+    raw = bytearray(os.urandom(16 * count))
+    for offset in range(0, 16 * count, 16):
+        raw[offset + 6] = (raw[offset + 6] & 0x0F) | 0x40  # version 4
+        raw[offset + 8] = (raw[offset + 8] & 0x3F) | 0x80  # RFC 4122 variant
+
+    # Ekahau ids are dashed UUIDs, so keep str(uuid.UUID) formatting, but
+    # hex the whole block once instead of building a UUID object per id.
+    hexed = raw.hex()
+    for i in range(0, 32 * count, 32):
+        h = hexed[i:i + 32]
+        yield f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def make_audit_timestamp(now=None):
+    """
+    Return (ms_since_epoch, iso_utc) for `now` (default: current time).
+
+    Computed once per run and shared by every note created in it.
     """
-    now = time.time()
+    if now is None:
+        now = time.time()
     ms_since_epoch = int(now * 1000)
 
     # Build ISO 8601 UTC with milliseconds, e.g. "2025-11-23T18:42:10.123Z"
     seconds = int(now)
     millis = int((now - seconds) * 1000)
     iso_utc = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{millis:03d}Z"
+    return ms_since_epoch, iso_utc
+
+
+def set_note_audit_fields(note, audit_timestamp, author_name="Brett Melnychuk"):
+    """
+    Sets both the legacy numeric timestamps and the newer history.* fields
+    so Ekahau shows the correct creator + time in the UI.
+
+    audit_timestamp is a (ms_since_epoch, iso_utc) pair from make_audit_timestamp().
+    """
+    ms_since_epoch, iso_utc = audit_timestamp
 
     # Top-level fields
     note["created"] = ms_since_epoch
@@ -235,34 +643,51 @@ def set_note_audit_fields(note, author_name="Brett Melnychuk"):
 
 
 # --- note creation: ONE NOTE PER IMAGE (RULE A) ------------------------------
-def create_new_note_for_ap(ap, notes_data, note_index):
+def build_note_factory(notes_data, audit_timestamp, author_name="Brett Melnychuk"):
     """
-    Create a brand new note for this AP and attach it (one image per note).
-    """
-    new_id = str(uuid.uuid4())
+    Build the new-note template once per run and return make_note(new_id, img_id).
 
+    The template is:
+      - a deep copy of the first existing note, with text/title blanked
+      - otherwise a minimal note
+    with the audit fields (same for every note in the run) already set,
+    so make_note only fills in id and imageIds.
+    """
     if notes_data.get("notes"):
-        template = notes_data["notes"][0]
-        note = json.loads(json.dumps(template))
-        note["id"] = new_id
-        if "text" in note:
-            note["text"] = ""
-        if "title" in note:
-            note["title"] = ""
-        note["imageIds"] = []
+        template = copy.deepcopy(notes_data["notes"][0])
+        if "text" in template:
+            template["text"] = ""
+        if "title" in template:
+            template["title"] = ""
     else:
-        note = {
-            "id": new_id,
+        template = {
+            "id": None,
             "text": "",
             "imageIds": [],
             "status": "CREATED"
         }
 
     # Set correct timestamps + user
-    set_note_audit_fields(note, author_name="Brett Melnychuk")
+    set_note_audit_fields(template, audit_timestamp, author_name=author_name)
+    history = template["history"]
+
+    def make_note(new_id, img_id):
+        note = template.copy()
+        note["id"] = new_id
+        note["imageIds"] = [img_id]
+        note["history"] = history.copy()
+        return note
+
+    return make_note
 
+
+def create_new_note_for_ap(ap, notes_data, make_note, new_id, img_id):
+    """
+    Create a brand new note with id `new_id` for this AP and attach it.
+    The note holds exactly one image: `img_id`.
+    """
+    note = make_note(new_id, img_id)
     notes_data.setdefault("notes", []).append(note)
-    note_index[new_id] = note
 
     note_ids = ap.get("noteIds")
     if note_ids is None:
@@ -304,54 +729,59 @@ def main():
         metavar="IMAGES_DIR",
         help="Root directory where AP images are stored (Format A: AP-Images/<Floor>/<AP>.png)",
     )
+    # No temporary project directory is created any more; still accepted so
+    # existing invocations keep working.
     parser.add_argument(
         "--keep-temp",
         action="store_true",
-        help="Do not delete the extracted project folder (for debugging).",
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Write the modified JSON files indented (for debugging) instead of compact.",
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Also print one line per AP that receives images.",
     )
 
     args = parser.parse_args()
 
+    if args.keep_temp:
+        print("NOTE: --keep-temp is deprecated and ignored (no temporary directory is used).")
+
+    # Per-AP detail is logged at DEBUG, so it costs nothing unless --verbose
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(message)s",
+        stream=sys.stdout,
+    )
+
     # Paths
     esx_src_path = os.path.abspath(args.src_esx)
     output_esx = os.path.abspath(args.dst_esx)
-    project_stem = pathlib.PurePath(esx_src_path).stem
-    extract_dir = os.path.abspath(project_stem)
     images_root = os.path.abspath(args.images_dir)
 
     if not os.path.isfile(esx_src_path):
         raise FileNotFoundError(f"ESX file not found: {esx_src_path}")
 
-    print(f"** Extracting Ekahau project: {esx_src_path}")
-    if os.path.exists(extract_dir):
-        print(f"   Temporary project directory '{extract_dir}' already exists, reusing it.")
-    else:
-        extract_project(esx_src_path, extract_dir)
-
-    # JSON paths
-    access_points_path = os.path.join(extract_dir, "accessPoints.json")
-    floor_plans_path = os.path.join(extract_dir, "floorPlans.json")
-    notes_path = os.path.join(extract_dir, "notes.json")
-    images_json_path = os.path.join(extract_dir, "images.json")
-
-    if not os.path.isfile(access_points_path):
-        raise FileNotFoundError(f"accessPoints.json not found in {extract_dir}")
-    if not os.path.isfile(floor_plans_path):
-        raise FileNotFoundError(f"floorPlans.json not found in {extract_dir}")
-    if not os.path.isfile(notes_path):
-        raise FileNotFoundError(f"notes.json not found in {extract_dir}")
-
-    accessPoints = load_json(access_points_path)
-    floorPlans = load_json(floor_plans_path)
-    notes = load_json(notes_path)
-    images_data = init_images_data(images_json_path)
+    print(f"** Reading Ekahau project: {esx_src_path}")
+    with open_project(esx_src_path) as zf:
+        for name in ("accessPoints.json", "floorPlans.json", "notes.json"):
+            if name not in zf.NameToInfo:
+                raise FileNotFoundError(f"{name} not found in {esx_src_path}")
+
+        accessPoints = load_json(zf, "accessPoints.json")
+        floorPlans = load_json(zf, "floorPlans.json")
+        notes = load_json(zf, "notes.json")
 
     floor_name_to_id = build_floor_name_to_id(floorPlans)
     # NEW: reverse lookup for pretty printing
     floor_id_to_name = {v: k for k, v in floor_name_to_id.items()}  # NEW
 
     ap_index = build_ap_index(accessPoints)
-    note_index = build_note_index(notes)
 
     print(f"** Scanning images in: {images_root}")
     ap_images, skipped_images_from_floors = collect_images(images_root, floor_name_to_id)  # NEW
@@ -360,59 +790,91 @@ def main():
         print("No AP images found to insert. Exiting.")
         return
 
-    print(f"** Found {len(ap_images)} APs with images in known floors.")
+    ap_count = sum(len(floor_images) for floor_images in ap_images.values())
+    print(f"** Found {ap_count} APs with images in known floors.")
 
-    inserted_count = 0
     skipped_count = 0
 
     # NEW: Track detailed info
     not_inserted_images = list(skipped_images_from_floors)  # images that couldn't be matched to any floor
-    ap_keys_with_images_inserted = set()
-
-    for (floor_id, ap_name), image_files in ap_images.items():
-        ap = ap_index.get((floor_id, ap_name))
-        if not ap:
-            print(f"WARNING: No AP named '{ap_name}' on floor id '{floor_id}', skipping its images.")
-            skipped_count += len(image_files)
-            not_inserted_images.extend(image_files)  # NEW: record these images as not inserted
-            continue
+    aps_with_images_inserted = set()  # id() of each AP dict that receives images
+
+    # Resolve each AP once and flatten its images into a single work list
+    jobs = []  # (AP dict, image path, imageFormat, stat)
+    for floor_id, floor_images in ap_images.items():
+        floor_aps = ap_index.get(floor_id, {})
+        for ap_key, image_files in floor_images.items():
+            candidates = floor_aps.get(ap_key, [])
+            # Resolve each filename spelling once, in order of first image
+            matched = {}
+            for ap_name in dict.fromkeys(image[3] for image in image_files):
+                ap = match_ap(candidates, ap_name) if candidates else None
+                if not ap:
+                    if candidates:
+                        names = ", ".join(f"'{c.get('name')}'" for c in candidates)
+                        print(f"WARNING: AP name '{ap_name}' is ambiguous on floor id '{floor_id}' "
+                              f"(matches {names}), skipping its images.")
+                    else:
+                        print(f"WARNING: No AP named '{ap_name}' on floor id '{floor_id}', skipping its images.")
+                matched[ap_name] = ap
+
+            # Images stay in filename order across spellings of the same AP
+            note_counts = {}  # id(AP dict) -> [AP dict, number of images]
+            for img_path, image_format, st, ap_name in image_files:
+                ap = matched[ap_name]
+                if not ap:
+                    skipped_count += 1
+                    not_inserted_images.append(img_path)  # NEW: record these images as not inserted
+                    continue
+                jobs.append((ap, img_path, image_format, st))
+                note_counts.setdefault(id(ap), [ap, 0])[1] += 1
+
+            for ap, count in note_counts.values():
+                aps_with_images_inserted.add(id(ap))  # NEW
+                log.debug("   AP '%s' (floorId=%s): creating %d note(s) with images.",
+                          ap.get("name"), floor_id, count)
+
+    print(f"** Creating {len(jobs)} note(s) with images for {len(aps_with_images_inserted)} AP(s).")
+
+    # Only modified JSON files are re-serialized into the destination project
+    json_members = {}
+    new_images = []  # (arcname, source image path, stat) to add to the project
+
+    if jobs:
+        # images.json is only parsed when there is something to add to it
+        with open_project(esx_src_path) as zf:
+            images_data = init_images_data(zf)
+        image_template = make_image_template(images_data)
+        # Same created/modified time for every new note
+        make_note = build_note_factory(notes, make_audit_timestamp())
+
+        json_members = {
+            "accessPoints.json": accessPoints,
+            "notes.json": notes,
+            "images.json": images_data,
+        }
 
-        for img_path in image_files:
-            # Create a brand-new note for this image
-            note = create_new_note_for_ap(ap, notes, note_index)
+        new_ids = generate_uuid4s(2 * len(jobs))  # one note id + one image id per image
 
-            img_id = str(uuid.uuid4())
-            note["imageIds"] = [img_id]   # exactly one image per note
+        for ap, img_path, image_format, st in jobs:
+            img_id = next(new_ids)
 
-            dest_filename = f"image-{img_id}"
-            dest_full_path = os.path.join(extract_dir, dest_filename)
+            # Create a brand-new note holding exactly this image
+            create_new_note_for_ap(ap, notes, make_note, next(new_ids), img_id)
 
-            # Write raw image file into project root
-            with open(img_path, "rb") as src_f, open(dest_full_path, "wb") as dst_f:
-                dst_f.write(src_f.read())
+            # Raw image data goes into the project root as image-<uuid>
+            new_images.append((f"image-{img_id}", img_path, st))
 
             # Add metadata entry into images.json
-            add_image_metadata(images_data, img_id, img_path)
-
-            inserted_count += 1
-
-        ap_keys_with_images_inserted.add((floor_id, ap_name))  # NEW
-        print(f"   AP '{ap_name}' (floorId={floor_id}): created {len(image_files)} note(s) with images.")
-
-    # Save modified JSON files
-    save_json(access_points_path, accessPoints)
-    save_json(notes_path, notes)
-    save_json(images_json_path, images_data)
+            add_image_metadata(images_data, img_id, image_format, image_template)
 
-    # Repack into the destination ESX provided on the command line
-    print(f"** Repacking project into: {output_esx}")
-    repack_project(extract_dir, output_esx)
+    inserted_count = len(jobs)
 
-    if not args.keep_temp:
-        print(f"** Cleaning up temporary directory: {extract_dir}")
-        shutil.rmtree(extract_dir, ignore_errors=True)
+    # Write the destination ESX provided on the command line
+    print(f"** Writing project to: {output_esx}")
+    rewrite_project(esx_src_path, output_esx, json_members, new_images, pretty_json=args.pretty)
 
-    print(f"** Done. Inserted {inserted_count} image(s), skipped {skipped_count} due to missing APs.")
+    print(f"** Done. Inserted {inserted_count} image(s), skipped {skipped_count} due to missing or ambiguous APs.")
 
     # NEW: Report images that were not inserted
     if not_inserted_images:
@@ -432,8 +894,7 @@ def main():
         if not name or not floor_id:
             # Skip APs that are not placed on a floor or have no name
             continue
-        key = (floor_id, name)
-        if key not in ap_keys_with_images_inserted:
+        if id(ap) not in aps_with_images_inserted:
             aps_without_images.append((floor_id, name))
 
     print(f"\n** APs in Ekahau that did NOT receive any images ({len(aps_without_images)}):")